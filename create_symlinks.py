@@ -8,6 +8,8 @@ import struct
 XFFTS_DIR = os.path.expanduser("/export/log/xffts")
 LINKS_DIR = os.path.expanduser("/export/log/xffts_links")
 XFFTS_PATTERN = r"^xffts2018(09|10)[0-9]{8}\.xfftsx\.0[1-4]$"
+OBSNUM_OFFSET = 32
+OBSNUM_STRUCT = struct.Struct("<q")
 
 
 def is_exists(path):
@@ -25,22 +27,20 @@ def create_symlink(path):
     path = is_exists(path)
 
     with open(path, "rb") as f:
-        f.seek(32)
-        obsnum_bin = f.read(8)
+        f.seek(OBSNUM_OFFSET)
+        obsnum_bin = f.read(OBSNUM_STRUCT.size)
     
     try:
-        obsnum = struct.Struct("q").unpack(obsnum_bin)[0]
+        obsnum = OBSNUM_STRUCT.unpack(obsnum_bin)[0]
     except struct.error:
         obsnum = "no_lmt"
 
     fname = os.path.basename(path)
     new_fname = "{obsnum}_{fname}".format(obsnum=obsnum, fname=fname)
     
-    new_path = os.path.expanduser(
-        "{links_dir}/{new_fname}".format(
-            links_dir=LINKS_DIR,
-            new_fname=new_fname
-        )
+    new_path = "{links_dir}/{new_fname}".format(
+        links_dir=LINKS_DIR,
+        new_fname=new_fname
     )
 
     try:
@@ -2,6 +2,9 @@
 # -*- coding: utf-8 -*-
 import sys
 import argparse
+from contextlib import ExitStack, contextmanager
+import dask
+import numexpr as ne
 import numpy as np
 import xarray as xr
 from datetime import datetime
@@ -15,6 +18,7 @@ CALS_DIR = Path("../cals").expanduser()
 QLOOK_DIR = Path("../qlooks").expanduser()
 PLOT_TYPE = ["otfmap", "psw", "timestream"]
 IF_NUM = 4
+T_CHUNK = 512
 IF_LABELS = [
     "IF1: B-POL (LSB)",
     "IF2: B-POL (USB)",
@@ -28,8 +32,53 @@ AXIS_LABEL_DICT = {
 }
 COLORS = ["tomato", "olivedrab", "palevioletred", "steelblue"]
 T_AMB = 273.
-USB_FREQ = (145.7 - 0.1) + np.linspace(0., 2.5, 2**15)
-LSB_FREQ = (132. - 0.1) + np.linspace(0., 2.5, 2**15)
+USB_FREQ = ((145.7 - 0.1) + np.linspace(0., 2.5, 2**15)).astype(np.float32)
+LSB_FREQ = ((132. - 0.1) + np.linspace(0., 2.5, 2**15)).astype(np.float32)
+N_POINTS = 2000
+
+
+def lttb_downsample(x, y, n_out):
+    """Downsample a line with the Largest-Triangle-Three-Buckets algorithm
+
+    Args:
+        x (numpy.ndarray): X values of the line (numeric or datetime64).
+        y (numpy.ndarray): Y values of the line.
+        n_out (int): Number of points after downsampling.
+            If None or not smaller than the number of points,
+            the line is returned as is.
+
+    Return:
+        x, y (tuple of numpy.ndarray): Downsampled X and Y values
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    n_in = len(x)
+    if not n_out or n_out >= n_in or n_out < 3:
+        return x, y
+
+    _x = x.astype(np.int64) if x.dtype.kind == "M" else x
+    _x, _y = _x.astype(np.float64), y.astype(np.float64)
+
+    # the first and the last points are always kept
+    edges = np.linspace(1, n_in - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, int)
+    indices[0], indices[-1] = 0, n_in - 1
+
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        if i < n_out - 3:
+            next_x = _x[edges[i + 1]:edges[i + 2]].mean()
+            next_y = _y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = _x[-1], _y[-1]
+
+        a = indices[i]
+        areas = np.abs(
+            (_x[a] - next_x) * (_y[start:stop] - _y[a])
+            - (_x[a] - _x[start:stop]) * (next_y - _y[a])
+        )
+        indices[i + 1] = start + np.argmax(areas)
+
+    return x[indices], y[indices]
 
 
 class NetCDF2Qlook(object):
@@ -45,17 +94,21 @@ class NetCDF2Qlook(object):
             Defaults to None.
         title (str): Title of quick-look plot.
             Defaults to 'Q-Look Plot'.
+        n_points (int): Number of points of each line in the plot.
+            Lines are downsampled by the LTTB algorithm.
+            If None or 0, all points are plotted. Defaults to 2000.
 
     Raises:
         FileNotFoundError: If doesn't exists files corresponded to ID
         TypeError: If the plot type is invalid
     """
-    def __init__(self, obs_id, plot_type, cal_id=None, title="Q-Look Plot"):
+    def __init__(self, obs_id, plot_type, cal_id=None, title="Q-Look Plot",
+                 n_points=N_POINTS):
         self.scis = [
             SCIS_DIR / f"xffts{obs_id}.xfftsx.0{i}.nc"
             for i in [1, 2, 3, 4]
         ]
-        if not all([f.exists() for f in self.scis]):
+        if not all(f.exists() for f in self.scis):
             raise FileNotFoundError(f"Data (ID : {obs_id}) : not found")
 
         if not plot_type in PLOT_TYPE:
@@ -67,7 +120,7 @@ class NetCDF2Qlook(object):
                 CALS_DIR / f"xffts{cal_id}.xfftsx.0{i}.nc"
                 for i in [1, 2, 3, 4]
             ]
-            if not all([f.exists() for f in self.cals]):
+            if not all(f.exists() for f in self.cals):
                 raise FileNotFoundError(
                     f"Calibration data (ID : {cal_id}) : not found"
                 )
@@ -77,6 +130,7 @@ class NetCDF2Qlook(object):
         self.obs_id = obs_id
         self.cal_id = cal_id
         self.title = title
+        self.n_points = n_points
 
     def otfmap(self):
         """Plot the OTF map
@@ -99,37 +153,34 @@ class NetCDF2Qlook(object):
         Return:
             plots (bokeh.models.layouts.Column): Plot of PSW data
         """
-        Rs, ONs, OFFs = [], [], []
-        for s, c in zip(self.scis, self.cals):
-            with xr.open_dataset(s) as sci, xr.open_dataset(c) as cal:
-                Rs.append((cal["array"] / cal["integtime"]).mean("t"))
-                ONs.append(
-                    (sci["array"] / sci["integtime"])[sci["bufpos"] == "ON"]
-                )
-                OFFs.append(
-                    (sci["array"] / sci["integtime"])[sci["bufpos"] == "REF"]
-                )
-        # print(ONs[0])
-        # print(OFFs[0])
-        Tcals = [
-            # T_AMB * (on - off[1:]) / (r - off[1:])
-            T_AMB * (on[4:] - off) / (r - off)
-            for r, on, off in zip(Rs, ONs, OFFs)
-        ]
+        tasks = []
+        with self._open_datasets(self.scis) as scis, \
+                self._open_datasets(self.cals) as cals:
+            for sci, cal in zip(scis, cals):
+                tasks.append(dask.delayed(self._calibrate)(
+                    sci["array"].data,
+                    sci["integtime"].data,
+                    sci["bufpos"].data,
+                    cal["array"].data,
+                    cal["integtime"].data,
+                ))
+
+            # read and calibrate all IFs in parallel threads
+            spectra = dask.compute(*tasks, scheduler="threads")
 
         plots = []
-        for i, (t, c) in enumerate(zip(Tcals, COLORS)):
+        for i, (spectrum, c) in enumerate(zip(spectra, COLORS)):
             if i == 0:
                 p = figure(title=self.title, plot_width=640, plot_height=360)
             else:
                 p = figure(plot_width=640, plot_height=360)
 
             if i == 0 or i == 2:
-                p.line(LSB_FREQ, t.mean("t").values,
-                    color=c, line_width=1., legend=IF_LABELS[i])
+                x, y = lttb_downsample(LSB_FREQ, spectrum, self.n_points)
+                p.line(x, y, color=c, line_width=1., legend=IF_LABELS[i])
             if i == 1 or i == 3:
-                p.line(USB_FREQ, t.mean("t").values,
-                    color=c, line_width=1., legend=IF_LABELS[i])
+                x, y = lttb_downsample(USB_FREQ, spectrum, self.n_points)
+                p.line(x, y, color=c, line_width=1., legend=IF_LABELS[i])
             plots.append(self._create_looks(p))
 
         plots = gridplot([plots[0], plots[1]], [plots[2], plots[3]])
@@ -144,20 +195,32 @@ class NetCDF2Qlook(object):
         Return:
             plots (bokeh.models.layouts.Column): Plot of time stream data
         """
-        plots = []
-        for i, (s, c) in enumerate(zip(self.scis, COLORS)):
-            with xr.open_dataset(s) as data:
-                time = np.array(
-                    [d[:-4] for d in data["date"].values],
-                    "datetime64[us]",
+        times, integs = [], []
+        with self._open_datasets(self.scis) as scis:
+            for data in scis:
+                # dates have a fixed width: drop their last 4 characters
+                # by casting to a shorter string dtype
+                dates = data["date"].values.astype("U")
+                n_chars = dates.dtype.itemsize // np.dtype("U1").itemsize
+                times.append(
+                    dates.astype(f"U{n_chars - 4}").astype("datetime64[us]")
                 )
-                flag = time < time[-1]
-                arrays = data["array"]
-                time = time[flag]
-                integ_data = np.average(arrays, axis=1)[flag]
-                # integ_data = arrays[:, 12000:18000].mean("array_dim0").values
-                del(arrays)
-                # x = np.arange(len(integ_data))
+
+                # integrate the (t, channel) spectra chunk by chunk
+                # in float32 without loading the whole array
+                arrays = data["array"].data
+                integs.append(arrays.mean(axis=-1, dtype=np.float32))
+                # integs.append(
+                #     arrays[:, 12000:18000].mean(axis=-1, dtype=np.float32)
+                # )
+
+            # reduce all IFs (of any lengths) in parallel threads
+            integs = dask.compute(*integs, scheduler="threads")
+
+        plots = []
+        for i, (time, integ, c) in enumerate(zip(times, integs, COLORS)):
+            flag = time < time[-1]
+            time, integ_data = time[flag], integ[flag]
 
             if i == 0:
                 p = figure(title=self.title, x_axis_type="datetime",
@@ -165,8 +228,8 @@ class NetCDF2Qlook(object):
             else:
                 p = figure(x_axis_type="datetime",
                            plot_width=640, plot_height=360)
-            p.line(time, integ_data, color=c,
-                   line_width=1., legend=IF_LABELS[i])
+            x, y = lttb_downsample(time, integ_data, self.n_points)
+            p.line(x, y, color=c, line_width=1., legend=IF_LABELS[i])
             plots.append(self._create_looks(p))
 
         plots = gridplot([plots[0], plots[1]], [plots[2], plots[3]])
@@ -193,6 +256,59 @@ class NetCDF2Qlook(object):
         save(p)
         return
 
+    @staticmethod
+    def _calibrate(sci_array, sci_integtime, bufpos, cal_array, cal_integtime):
+        """Calibrate the PSW data of an IF
+
+        Args:
+            sci_array (numpy.ndarray): Spectra of the observational data.
+            sci_integtime (numpy.ndarray): Integration time of each spectrum
+                of the observational data.
+            bufpos (numpy.ndarray): Buffer position ('ON' or 'REF') of each
+                spectrum of the observational data.
+            cal_array (numpy.ndarray): Spectra of the calibration data.
+            cal_integtime (numpy.ndarray): Integration time of each spectrum
+                of the calibration data.
+
+        Return:
+            spectrum (numpy.ndarray): Time-averaged calibrated spectrum
+        """
+        r = np.mean(cal_array / cal_integtime[:, None], axis=0)
+
+        scaled = sci_array / sci_integtime[:, None]
+        on = scaled[bufpos == "ON"]
+        off = scaled[bufpos == "REF"]
+
+        # t = T_AMB * (on - off[1:]) / (r - off[1:])
+        t = ne.evaluate(
+            "T_AMB * (on - off) / (r - off)",
+            local_dict={"T_AMB": T_AMB, "on": on[4:], "off": off, "r": r},
+        )
+        return np.mean(t, axis=0).astype(np.float32)
+
+    @contextmanager
+    def _open_datasets(self, paths):
+        """Open the NetCDF files of the IFs
+
+        Each IF is opened on its own, so the IFs may have different
+        numbers of records. Data are loaded lazily in dask chunks along t.
+
+        Args:
+            paths (list of pathlib.Path): Paths of the NetCDF files
+                ordered by IF number.
+
+        Return:
+            datasets (list of xarray.Dataset): Dask-backed dataset of each
+                IF, closed at the end of the with statement
+        """
+        with ExitStack() as stack:
+            yield [
+                stack.enter_context(
+                    xr.open_dataset(path, chunks={"t": T_CHUNK})
+                )
+                for path in paths
+            ]
+
     def _create_looks(self, plot, power_unit="a.u."):
         """Create the looks of the plot
 
@@ -202,21 +318,25 @@ class NetCDF2Qlook(object):
         Return:
             plot (bokeh.plotting.figure.Figure): Instance of the shaped plot
         """
-        plot.title.text_font_size = "16pt"
-        plot.legend.location = "top_right"
-        plot.legend.background_fill_alpha = 0.5
-        plot.xaxis.axis_label = AXIS_LABEL_DICT[self.type]["x"]
-        plot.xaxis.axis_label_text_font_size = "12pt"
-        plot.xaxis.axis_label_text_font_style = "bold"
-        plot.yaxis.axis_label = AXIS_LABEL_DICT[self.type]["y"]
-        plot.yaxis.axis_label_text_font_size = "12pt"
-        plot.yaxis.axis_label_text_font_style = "bold"
+        plot.title.update(text_font_size="16pt")
+        plot.legend.update(location="top_right", background_fill_alpha=0.5)
+        plot.xaxis.update(
+            axis_label=AXIS_LABEL_DICT[self.type]["x"],
+            axis_label_text_font_size="12pt",
+            axis_label_text_font_style="bold",
+        )
+        plot.yaxis.update(
+            axis_label=AXIS_LABEL_DICT[self.type]["y"],
+            axis_label_text_font_size="12pt",
+            axis_label_text_font_style="bold",
+        )
         return plot
 
 
 def main():
     _usage = "python netcdf2qlook OBS_ID" \
-        + " [-t --type TYPE] [-c --cal_id CAL_ID] [--title TITLE]"
+        + " [-t --type TYPE] [-c --cal_id CAL_ID] [--title TITLE]" \
+        + " [-n --n_points N_POINTS]"
     parser = argparse.ArgumentParser(
         prog="netcdf2qlook",
         usage=_usage,
@@ -232,10 +352,14 @@ def main():
                         dest="cal_id", help="ID of the calibration data")
     parser.add_argument("--title", type=str, dest="title",
                         default="Q-Look plot", help="title of plot")
+    parser.add_argument("-n", "--n_points", type=int, dest="n_points",
+                        default=N_POINTS,
+                        help="number of points of each line (0: all points)")
     args = parser.parse_args()
 
     n2q = NetCDF2Qlook(args.obs_id, args.type,
-                       cal_id=args.cal_id, title=args.title)
+                       cal_id=args.cal_id, title=args.title,
+                       n_points=args.n_points)
     n2q.save()
     return
 
@@ -1,5 +1,6 @@
 # standard library
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 
@@ -8,6 +9,7 @@ import numpy as np
 
 
 # constants
+CHUNKSIZE = 32
 DOT = "."
 DTYPES = [
     ("time", "a28"),
@@ -28,15 +30,14 @@ OBSNUM = "obsnum"
 # helper functions
 def get_obsnum(xffts: Path, /) -> int:
     """Read the observation number from an XFFTS log."""
+    dtype, offset = np.dtype(DTYPES).fields[OBSNUM]
+
     with open(xffts, "rb") as f:
-        try:
-            log = np.frombuffer(f.read(), dtype=DTYPES)
-        except ValueError:
-            return 0
+        f.seek(offset)
 
         try:
-            obsnum = int(log[OBSNUM][0])
-        except IndexError:
+            obsnum = int(np.frombuffer(f.read(dtype.itemsize), dtype)[0])
+        except (ValueError, IndexError):
             return 0
 
         if 0 < obsnum < 1000000:
@@ -62,5 +63,10 @@ if __name__ == "__main__":
     except IndexError:
         path = Path().resolve()
 
-    for xffts in list(path.glob("**/xffts*.*")):
-        print(f"{xffts} -> {rename(xffts)}")
+    xfftss = list(path.glob("**/xffts*.*"))
+
+    with ProcessPoolExecutor() as executor:
+        renamed = executor.map(rename, xfftss, chunksize=CHUNKSIZE)
+
+        for xffts, new in zip(xfftss, renamed):
+            print(f"{xffts} -> {new}")
@@ -8,9 +8,8 @@ Usage: $ python xffts2netcdf.py <xffts binary file> <netcdf>
 
 # standard library
 import os
-import re
 import sys
-from collections import deque, OrderedDict
+from collections import OrderedDict
 from pathlib import Path
 from struct import Struct
 
@@ -50,6 +49,18 @@ CONFIG = [
     ('array', 'f', 32768)
 ]
 '''
+FMT_DTYPES = {
+    # format character: (kind of binary dtype, dtype of netCDF variable)
+    **dict.fromkeys('bhil', ('i', np.int32)),
+    **dict.fromkeys('BHIL', ('u', np.int32)),
+    'q': ('i', np.int64),
+    'Q': ('u', np.int64),
+    **dict.fromkeys('ef', ('f', np.float32)),
+    'd': ('f', np.float64),
+    **dict.fromkeys('csp', ('S', str)),
+    '?': ('?', np.bool_),
+}
+BATCH_SIZE = 8 << 20  # bytes
 
 
 # functions and classes
@@ -80,7 +91,7 @@ class Struct2NetCDF:
 
         # initialization
         self.config = self.parse_config(config)
-        self.struct = self.create_struct()
+        self.dtype = self.create_dtype()
         self.dataset = self.create_empty_dataset()
 
         # initialize writing counter
@@ -88,39 +99,64 @@ class Struct2NetCDF:
 
         # aliases
         self.close = self.dataset.close
-        self.readsize = self.struct.size
+        self.readsize = self.dtype.itemsize
 
     def write(self, binary):
         """Convert binary data compatible to netCDF format and write it."""
+        # an empty binary is passed through to raise EOFError
+        assert not binary or len(binary) == self.readsize
+        self.write_batch(binary)
+
+    def write_batch(self, binary):
+        """Convert binary data of structures to netCDF format and write them.
+
+        Args:
+            binary (bytes-like object): Concatenated structures whose
+                length is a multiple of the structure size.
+
+        """
         if len(binary) == 0:
             raise EOFError('Reached the end of file')
 
-        assert len(binary) == self.readsize
-        data = deque(self.struct.unpack(binary))
+        assert not len(binary) % self.readsize
+        data = np.frombuffer(binary, self.dtype)
+        n_data = len(data)
 
-        for name, (fmt, shape) in self.config.items():
+        for name in self.config:
             variable = self.dataset[name]
+            variable[self.n_write:self.n_write+n_data] = data[name]
+
+        self.n_write += n_data
+
+    def create_dtype(self):
+        """Create structured dtype object for reading binary string."""
+        fields = []
+
+        for name, (fmt, shape) in self.config.items():
+            kind, _ = self.lookup_fmt(fmt)
+            size = Struct(self.byteorder + fmt).size
+
+            if kind == 'S':
+                dtype = f'S{size}'
+            elif kind == '?':
+                dtype = '?'
+            else:
+                dtype = f'{self.byteorder}{kind}{size}'
 
             # in the case of no additional dimensions
             if shape == (1,):
-                variable[self.n_write] = data.popleft()
+                fields.append((name, dtype))
                 continue
 
             # otherwise
-            flat = [data.popleft() for i in range(np.prod(shape))]
-            variable[self.n_write] = np.reshape(flat, shape)
-
-        self.n_write += 1
+            fields.append((name, dtype, shape))
 
-    def create_struct(self):
-        """Create structure object for unpacking binary string."""
-        joined = ''.join(c*np.prod(s) for c, s in self.config.values())
-        return Struct(self.byteorder + joined)
+        return np.dtype(fields)
 
     def create_empty_dataset(self):
         """Create empty netCDF dataset according to structure config."""
         # add unlimited dimension
-        empty = Dataset(self.path, 'w')
+        empty = Dataset(self.path, 'w', format='NETCDF4')
         empty.createDimension(self.unlimited_dim)
 
         # add variables and additional dimensions
@@ -141,9 +177,15 @@ class Struct2NetCDF:
                 dim, size = dims[i], shape[i]
                 empty.createDimension(dim, size)
 
+            # chunk by a record and compress (zlib with shuffle filter)
             dims = (self.unlimited_dim,) + tuple(dims)
-            empty.createVariable(name, dtype, dims)
+            chunksizes = (1,) + tuple(shape)
+            empty.createVariable(name, dtype, dims, zlib=True, complevel=1,
+                                 shuffle=True, chunksizes=chunksizes)
 
+        # write raw values without masked-array conversions
+        empty.set_auto_mask(False)
+        empty.set_auto_scale(False)
         return empty
 
     @staticmethod
@@ -171,19 +213,14 @@ class Struct2NetCDF:
     @staticmethod
     def convert_fmt_to_dtype(fmt):
         """Convert format character to NumPy dtype object."""
-        if re.search('[bhil]', fmt, re.I):
-            return np.int32
-        elif re.search('[q]', fmt, re.I):
-            return np.int64
-        elif re.search('[ef]', fmt):
-            return np.float32
-        elif re.search('[d]', fmt):
-            return np.float64
-        elif re.search('[csp]', fmt):
-            return np.str
-        elif re.search('[?]', fmt):
-            return np.bool
-        else:
+        return Struct2NetCDF.lookup_fmt(fmt)[1]
+
+    @staticmethod
+    def lookup_fmt(fmt):
+        """Look up dtypes of format whose last character is the type."""
+        try:
+            return FMT_DTYPES[fmt[-1]]
+        except (IndexError, KeyError):
             raise ValueError(fmt)
 
     def __enter__(self):
@@ -215,9 +252,18 @@ def main():
         assert not filesize % readsize
         n_struct = int(filesize / readsize)
 
-        for i in tqdm(range(n_struct)):
-            binary = f.read(readsize)
-            g.write(binary)
+        # reuse one buffer of whole structures for every batch
+        n_batch = max(1, BATCH_SIZE // readsize)
+        buffer = memoryview(bytearray(readsize * n_batch))
+
+        with tqdm(total=n_struct) as pbar:
+            while True:
+                n_read = f.readinto(buffer)
+                if not n_read:
+                    break
+
+                g.write_batch(buffer[:n_read])
+                pbar.update(n_read // readsize)
 
 
 # command line tool